@@ -10,13 +10,17 @@ from tensorlake.documentai import (
     OcrPipelineProvider,
 )
 
+import io
 import json
-from bs4 import BeautifulSoup
-from tabulate import tabulate
-import tempfile
-import pandas as pd
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from selectolax.lexbor import LexborHTMLParser
+import orjson
+import pyarrow as pa
 import httpx
 import os
+import sys
 
 # ===================================================
 # 🔑 CONFIG — Insert your REAL Tensorlake API key here
@@ -30,84 +34,272 @@ API_KEY = "tl_apiKey_kqzrz7zrf97fHr7mK8CRh_TsyhVykSJ6XzbQp9LcY_y2Nk2m4-u3"  # <-
 # 🔧 FIXED — Correct Tensorlake v2 Upload Function
 # ===================================================
 
-def upload_file_v2(path):
+class TensorlakeError(Exception):
     """
-    Uploads a file to Tensorlake using the correct v2 API:
+    Raised when Tensorlake rejects an upload or a parse does not succeed.
+    """
+
+
+@st.cache_resource
+def get_http_client():
+    # No write timeout: large scans can take longer than 30s to send
+    return httpx.Client(http2=True, timeout=httpx.Timeout(30, write=None))
+
+
+@st.cache_resource
+def get_doc_ai(api_key):
+    return DocumentAI(api_key=api_key)
+
+
+def upload_file_v2(pdf_bytes, api_key):
+    """
+    Uploads PDF bytes to Tensorlake using the correct v2 API:
     PUT /documents/v2/files
     """
     url = "https://api.tensorlake.ai/documents/v2/files"
 
-    with open(path, "rb") as f:
-        files = {"file_bytes": ("file.pdf", f, "application/pdf")}
-        data = {"labels": json.dumps({"source": "streamlit_app"})}
+    files = {"file_bytes": ("file.pdf", pdf_bytes, "application/pdf")}
+    data = {"labels": json.dumps({"source": "streamlit_app"})}
 
-        response = httpx.put(
-            url,
-            headers={"Authorization": f"Bearer {API_KEY}"},
-            files=files,
-            data=data,
-            timeout=30
-        )
+    response = get_http_client().put(
+        url,
+        headers={"Authorization": f"Bearer {api_key}"},
+        files=files,
+        data=data,
+    )
 
     if response.status_code != 200:
-        raise Exception(f"Upload failed {response.status_code}: {response.text}")
+        raise TensorlakeError(f"Upload failed {response.status_code}: {response.text}")
 
     return response.json()["file_id"]
 
 
+ENRICHMENT_OPTIONS = EnrichmentOptions(
+    figure_summarization=False,
+    table_summarization=False,
+)
+
+
+@st.cache_data(show_spinner=False, max_entries=16, ttl=3600)
+def parse_pdf(pdf_bytes, api_key, parsing_options):
+    """
+    Uploads and parses a PDF, returning the processed pages.
+    Cached on the PDF bytes and options so Streamlit reruns and
+    re-uploads of the same file skip the Tensorlake round-trip
+    and the HTML post-processing.
+    """
+    file_id = upload_file_v2(pdf_bytes, api_key)
+
+    doc_ai = get_doc_ai(api_key)
+
+    result = doc_ai.parse_and_wait(
+        file_id=file_id,
+        parsing_options=ParsingOptions(**parsing_options),
+        enrichment_options=ENRICHMENT_OPTIONS,
+    )
+
+    if result.status != ParseStatus.SUCCESSFUL:
+        raise TensorlakeError(f"Parsing failed: {result.status}")
+
+    return {"pages": build_pages([chunk.content for chunk in result.chunks])}
+
+
 
 # ===================================================
 # Helper Functions
 # ===================================================
 
+# Report tables repeat the same few values, so conversions are cached
+@lru_cache(maxsize=4096)
 def clean_number(value):
-    try:
-        return int(value.replace(",", ""))
-    except Exception:
+    if not isinstance(value, str):
         return value
+    digits = value.replace(",", "")
+    unsigned = digits[1:] if digits.startswith(("-", "+")) else digits
+    return int(digits) if unsigned.isdecimal() else value
+
+def clean_note(value):
+    return clean_number(value) if value else None
 
 def fix_duplicate_headers(headers):
     seen = {}
+    taken = set()
     fixed = []
     for h in headers:
-        key = h if h.strip() else "col"
-        if key not in seen:
-            seen[key] = 1
-            fixed.append(key)
-        else:
-            seen[key] += 1
-            fixed.append(f"{key}_{seen[key]}")
+        key = h or "col"
+        n = seen.get(key, 0) + 1
+        name = key if n == 1 else f"{key}_{n}"
+        # A suffixed name can collide with a real header, e.g. "a", "a", "a_2"
+        while name in taken:
+            n += 1
+            name = f"{key}_{n}"
+        seen[key] = n
+        taken.add(name)
+        # Headers repeat on every page, so keep one copy of each name
+        fixed.append(sys.intern(name))
     return fixed
 
 def html_table_to_matrix(table):
-    rows = table.find_all("tr")
-    return [[cell.get_text(strip=True) for cell in row.find_all(["td", "th"])] for row in rows]
+    return [
+        [cell.text(strip=True) for cell in row.iter() if cell.tag in ("td", "th")]
+        for row in table.css("tr")
+    ]
+
+@lru_cache(maxsize=256)
+def grid_layout(widths):
+    border = "+" + "+".join("-" * (w + 2) for w in widths) + "+"
+    row_format = "| " + " | ".join(f"{{:<{w}}}" for w in widths) + " |"
+    return border, border.replace("-", "="), row_format
+
+def render_grid(headers, rows):
+    # Multi-line cells are split so every line of a row is padded on its own
+    cells = [[cell.split("\n") for cell in row] for row in (headers, *rows)]
+    widths = tuple(
+        max(len(line) for cell in col for line in cell) for col in zip(*cells)
+    )
+    border, header_border, row_format = grid_layout(widths)
+
+    def row_lines(row):
+        height = max(map(len, row), default=1)
+        return [
+            row_format.format(*(cell[i] if i < len(cell) else "" for cell in row))
+            for i in range(height)
+        ]
+
+    lines = [border, *row_lines(cells[0]), header_border]
+    for row in cells[1:]:
+        lines.extend(row_lines(row))
+        lines.append(border)
+    return "\n".join(lines)
+
+_HEADER_MAP = {
+    "2024": "year_2024",
+    "year_2024": "year_2024",
+    "2023": "year_2023",
+    "as restated 2023": "year_2023",
+    "year_2023": "year_2023",
+    "note": "note",
+}
 
-def html_table_to_objects(table):
-    matrix = html_table_to_matrix(table)
-    if not matrix or len(matrix) < 2:
-        return []
+_FIELD_CONVERTERS = {
+    "year_2024": clean_number,
+    "year_2023": clean_number,
+    "note": clean_note,
+}
 
-    header = matrix[0]
-    objects = []
+def html_table_to_columns(header, rows):
+    columns = {}
 
-    for row in matrix[1:]:
-        entry = {}
-        for h, v in zip(header, row):
-            h_low = h.lower().strip()
+    for h, column in zip(header, zip(*rows)):
+        field = _HEADER_MAP.get(h.lower(), "name")
+        convert = _FIELD_CONVERTERS.get(field)
+        columns[field] = list(map(convert, column)) if convert else list(column)
 
-            if h_low in ["2024", "year_2024"]:
-                entry["year_2024"] = clean_number(v)
-            elif h_low in ["2023", "as restated 2023", "year_2023"]:
-                entry["year_2023"] = clean_number(v)
-            elif h_low == "note":
-                entry["note"] = clean_number(v) if v else None
-            else:
-                entry["name"] = v
+    return columns
 
-        objects.append(entry)
+# Characters the HTML parser would treat as markup or normalise away
+_MARKUP_CHARS = frozenset("<&\r\0")
 
-    return objects
+def process_page(raw_markdown):
+    """
+    Splits one chunk into its plain text (tables removed) and its tables.
+    """
+    # Markup-free pages parse to a single text node, so skip the DOM
+    if not _MARKUP_CHARS.intersection(raw_markdown):
+        return raw_markdown.strip(), []
+
+    tree = LexborHTMLParser(raw_markdown)
+    tables = tree.css("table")
+
+    # Innermost first: each table is read only once its nested tables are
+    # gone, so their rows are not repeated in the parent
+    table_matrices = []
+    for t in reversed(tables):
+        table_matrices.append(html_table_to_matrix(t))
+        t.decompose()
+    table_matrices.reverse()
+
+    # Join on NUL, then drop the empty pieces left by whitespace-only nodes
+    text_nodes = tree.body.text(separator="\0", strip=True).split("\0")
+    text_plain = "\n".join(filter(None, text_nodes))
+
+    page_tables = []
+
+    for t_index, matrix in enumerate(table_matrices, start=1):
+        if not matrix or len(matrix) < 2:
+            continue
+
+        headers = fix_duplicate_headers(matrix[0])
+        width = len(headers)
+        rows = [
+            row + [""] * (width - len(row)) if len(row) < width else row[:width]
+            for row in matrix[1:]
+        ]
+
+        page_tables.append({
+            "table_index": t_index,
+            "headers": headers,
+            "rows": rows,
+            "columns": html_table_to_columns(matrix[0], rows),
+        })
+
+    return text_plain, page_tables
+
+def build_pages(chunks):
+    # Repeated pages (blank pages, boilerplate) are only parsed once.
+    # The HTML parser releases the GIL, so pages parse in parallel.
+    unique_pages = list(dict.fromkeys(chunks))
+    workers = min(8, os.cpu_count() or 1, len(unique_pages))
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            parsed = list(executor.map(process_page, unique_pages))
+    else:
+        parsed = list(map(process_page, unique_pages))
+    parsed_pages = dict(zip(unique_pages, parsed))
+
+    # Plain (page_number, text_display, text_plain, tables) tuples: parse_pdf
+    # results are pickled by st.cache_data, and a class defined in this
+    # script is redefined by every session's rerun
+    return [
+        (i, raw_markdown, *parsed_pages[raw_markdown])
+        for i, raw_markdown in enumerate(chunks, start=1)
+    ]
+
+def format_page_text(page_number, text_plain):
+    return f"\n\n===== PAGE {page_number} =====\n\n{text_plain}\n\n".encode("utf-8")
+
+def build_text(pages):
+    buf = io.BytesIO()
+    for page_number, _, text_plain, _ in pages:
+        buf.write(format_page_text(page_number, text_plain))
+    return buf.getvalue()
+
+def build_text_with_tables(pages):
+    buf = io.BytesIO()
+    for page_number, _, text_plain, tables in pages:
+        buf.write(format_page_text(page_number, text_plain))
+        for table in tables:
+            buf.write((render_grid(table["headers"], table["rows"]) + "\n\n").encode("utf-8"))
+    return buf.getvalue()
+
+def build_tables_json(pages):
+    all_tables_json = {"tables": [
+        {
+            "page": page_number,
+            "table_index": table["table_index"],
+            "columns": table["columns"],
+        }
+        for page_number, _, _, tables in pages
+        for table in tables
+    ]}
+    return orjson.dumps(all_tables_json, option=orjson.OPT_INDENT_2)
+
+def zip_outputs(files):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED, compresslevel=1) as zf:
+        for name, data in files:
+            zf.writestr(name, data)
+    return buf.getvalue()
 
 
 
@@ -124,45 +316,78 @@ if "results" not in st.session_state:
 # Rendering Function
 # ===================================================
 
+def cached_payload(results, build):
+    """
+    Returns a download callable that builds its payload from the pages
+    on first click and keeps the bytes in the results for later clicks.
+    """
+    downloads = results.setdefault("downloads", {})
+
+    def payload():
+        if build.__name__ not in downloads:
+            downloads[build.__name__] = build(results["pages"])
+        return downloads[build.__name__]
+
+    return payload
+
 def render_results(results):
     if not results:
         return
 
-    for page in results["pages"]:
-        st.header(f"📄 Page {page['page_number']}")
+    for page_number, text_display, _, tables in results["pages"]:
+        st.header(f"📄 Page {page_number}")
 
         st.subheader("📝 Extracted Text")
-        st.markdown(page["text_display"])
+        st.markdown(text_display)
 
-        for t_index, table in enumerate(page["tables"], start=1):
+        for t_index, table in enumerate(tables, start=1):
             st.subheader(f"📊 Table {t_index}")
-            df = pd.DataFrame(table["rows"], columns=table["headers"])
-            st.table(df)
+            columns = zip(*table["rows"])
+            arrow_table = pa.table({
+                h: pa.array(col, type=pa.string()) for h, col in zip(table["headers"], columns)
+            })
+            st.dataframe(arrow_table, hide_index=True)
 
     # Downloads
     st.success("✅ Extraction complete!")
 
+    # Download payloads are only built when their button is clicked
+    text = cached_payload(results, build_text)
+    text_with_tables = cached_payload(results, build_text_with_tables)
+    tables_json = cached_payload(results, build_tables_json)
+
     st.download_button(
         "📥 Download Text (No Tables)",
-        results["full_text_output"].encode("utf-8"),
+        text,
         file_name="document.txt",
         mime="text/plain",
     )
 
     st.download_button(
         "📥 Download Text + Tables",
-        results["full_text_with_tables"].encode("utf-8"),
+        text_with_tables,
         file_name="document_with_tables.txt",
         mime="text/plain",
     )
 
     st.download_button(
         "📥 Download Tables JSON",
-        json.dumps(results["all_tables_json"], indent=4).encode("utf-8"),
+        tables_json,
         file_name="tables.json",
         mime="application/json",
     )
 
+    st.download_button(
+        "📦 Download All (ZIP)",
+        lambda: zip_outputs([
+            ("document.txt", text()),
+            ("document_with_tables.txt", text_with_tables()),
+            ("tables.json", tables_json()),
+        ]),
+        file_name="document_outputs.zip",
+        mime="application/zip",
+    )
+
 
 
 # ===================================================
@@ -298,7 +523,7 @@ if st.session_state["results"] and not run_button:
 
 if run_button:
 
-    if not API_KEY or API_KEY.startswith("YOUR_API_KEY"):
+    if not API_KEY.startswith("tl_apiKey_"):
         st.error("❌ Please enter a valid Tensorlake API Key at the top of the code.")
         st.stop()
 
@@ -306,103 +531,25 @@ if run_button:
         st.error("Please upload a PDF file.")
         st.stop()
 
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
-        tmp.write(uploaded_pdf.read())
-        temp_pdf_path = tmp.name
+    parsing_options = dict(
+        chunking_strategy=chunking_choice,
+        table_output_mode=table_output_choice,
+        table_parsing_format=table_parsing_choice,
+        ocr_model=ocr_map[ocr_choice],
+        cross_page_header_detection=cross_page_headers,
+        signature_detection=signature_detection,
+        remove_strikethrough_lines=remove_strike,
+        skew_detection=skew_detection,
+        disable_layout_detection=disable_layout_detection,
+    )
 
     try:
-        with st.spinner("📤 Uploading file..."):
-            file_id = upload_file_v2(temp_pdf_path)
-
-        doc_ai = DocumentAI(api_key=API_KEY)
-
-        parsing_options = ParsingOptions(
-            chunking_strategy=chunking_choice,
-            table_output_mode=table_output_choice,
-            table_parsing_format=table_parsing_choice,
-            ocr_model=ocr_map[ocr_choice],
-            cross_page_header_detection=cross_page_headers,
-            signature_detection=signature_detection,
-            remove_strikethrough_lines=remove_strike,
-            skew_detection=skew_detection,
-            disable_layout_detection=disable_layout_detection,
-        )
-
-        enrichment_options = EnrichmentOptions(
-            figure_summarization=False,
-            table_summarization=False,
-        )
-
-        with st.spinner("🔍 Parsing PDF..."):
-            result = doc_ai.parse_and_wait(
-                file_id=file_id,
-                parsing_options=parsing_options,
-                enrichment_options=enrichment_options,
+        with st.spinner("🔍 Uploading and parsing PDF..."):
+            st.session_state["results"] = parse_pdf(
+                uploaded_pdf.getvalue(), API_KEY, parsing_options
             )
+    except TensorlakeError as e:
+        st.error(f"❌ {e}")
+        st.stop()
 
-        if result.status != ParseStatus.SUCCESSFUL:
-            st.error(f"❌ Parsing failed: {result.status}")
-            st.stop()
-
-        # ===================================================
-        # Build result structure
-        # ===================================================
-
-        full_text_output = ""
-        full_text_with_tables = ""
-        all_tables_json = {"tables": []}
-        pages = []
-
-        for i, chunk in enumerate(result.chunks, start=1):
-            raw_markdown = chunk.content
-            soup = BeautifulSoup(raw_markdown, "html.parser")
-            tables = soup.find_all("table")
-
-            for t in tables:
-                t.extract()
-
-            text_plain = soup.get_text("\n", strip=True)
-
-            full_text_output += f"\n\n===== PAGE {i} =====\n\n{text_plain}\n\n"
-            full_text_with_tables += f"\n\n===== PAGE {i} =====\n\n{text_plain}\n\n"
-
-            page_tables = []
-
-            for t_index, table in enumerate(tables, start=1):
-                matrix = html_table_to_matrix(table)
-                if not matrix or len(matrix) < 2:
-                    continue
-
-                headers = fix_duplicate_headers(matrix[0])
-                rows = matrix[1:]
-
-                readable = tabulate(rows, headers=headers, tablefmt="grid")
-                full_text_with_tables += readable + "\n\n"
-
-                all_tables_json["tables"].append({
-                    "page": i,
-                    "table_index": t_index,
-                    "rows": html_table_to_objects(table),
-                })
-
-                page_tables.append({"headers": headers, "rows": rows})
-
-            pages.append({
-                "page_number": i,
-                "text_display": raw_markdown,
-                "text_plain": text_plain,
-                "tables": page_tables,
-            })
-
-        st.session_state["results"] = {
-            "pages": pages,
-            "full_text_output": full_text_output,
-            "full_text_with_tables": full_text_with_tables,
-            "all_tables_json": all_tables_json,
-        }
-
-        render_results(st.session_state["results"])
-
-    finally:
-        if os.path.exists(temp_pdf_path):
-            os.remove(temp_pdf_path)
+    render_results(st.session_state["results"])